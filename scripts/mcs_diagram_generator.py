@@ -5,13 +5,48 @@ from a rendered Helm chart template.
 
 import argparse
 import subprocess
+import sys
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import IO, Iterator
 import re
 import yaml
 
 MULTI_CLUSTER_SERVICE_KIND = "MultiClusterService"
 SERVICE_TEMPLATE_KIND = "ServiceTemplate"
 
+# Key paths used by Resource.deep_get.
+NAME_PATH = ("name",)
+KIND_PATH = ("kind",)
+METADATA_NAME_PATH = ("metadata", "name")
+LOCAL_SOURCE_REF_PATH = ("spec", "resources", "localSourceRef")
+DEPENDS_ON_PATH = ("spec", "dependsOn")
+SERVICES_PATH = ("spec", "serviceSpec", "services")
+TEMPLATE_RESOURCE_REFS_PATH = ("spec", "serviceSpec", "templateResourceRefs")
+RESOURCE_NAME_PATH = ("resource", "name")
+RESOURCE_KIND_PATH = ("resource", "kind")
+
+# Parts of MultiClusterService and ServiceTemplate documents that are read when
+# building resources. A None value keeps the whole subtree.
+RELEVANT_KEYS = {
+    "kind": None,
+    "metadata": {"name": None},
+    "spec": {
+        "resources": {"localSourceRef": None},
+        "dependsOn": None,
+        "serviceSpec": {"services": None, "templateResourceRefs": None},
+    },
+}
+MERGE_TAG = "tag:yaml.org,2002:merge"
+
+# Prefer the libyaml-backed loader; fall back to the pure-Python one if PyYAML
+# was built without libyaml.
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Matches Helm template placeholders such as "{{ .Release.Name }}".
+PLACEHOLDER_RE = re.compile(r"\{\{\s*.(.*?)\s*\}\}")
+
 
 def parse_arguments() -> argparse.Namespace:
     """
@@ -34,39 +69,151 @@ def parse_arguments() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def render_helm_template(chart_dir: str, release_name: str = "k0rdent-istio") -> str:
+class NamedStream:
+    """
+    Wraps a binary stream with a readable name, which the YAML parser shows in
+    error locations instead of a bare pipe file descriptor.
+    """
+
+    def __init__(self, stream: IO[bytes], name: str) -> None:
+        self._stream = stream
+        self.name = name
+
+    def read(self, size: int = -1) -> bytes:
+        return self._stream.read(size)
+
+
+@contextmanager
+def render_helm_template(
+    chart_dir: str, release_name: str = "k0rdent-istio"
+) -> Iterator[NamedStream]:
     """
     Render a Helm chart template using the 'helm template' command.
+    The rendered output is streamed from helm's stdout instead of being
+    collected in memory, so parsing can overlap with rendering. The stream is
+    binary and is decoded by the YAML parser.
     Args:
         chart_dir (str): Path to the Helm chart directory.
         release_name (str): Name of the Helm release.
-    Returns:
-        str: Rendered Helm template as a string.
+    Yields:
+        NamedStream: Binary stream with the rendered Helm template.
+    Raises:
+        subprocess.CalledProcessError: If helm exits with a non-zero code, also when
+            its partial output failed to parse.
     """
 
-    result = subprocess.run(
+    with subprocess.Popen(
         ["helm", "template", release_name, chart_dir],
-        capture_output=True,
-        text=True,
-        check=True,
-    )
-    return result.stdout
+        stdout=subprocess.PIPE,
+    ) as proc:
+        try:
+            yield NamedStream(proc.stdout, f"<helm template {release_name}>")
+        except yaml.YAMLError as err:
+            # Report a helm failure rather than the parse error of its partial output.
+            proc.communicate()
+            if proc.returncode != 0:
+                raise subprocess.CalledProcessError(
+                    proc.returncode, proc.args
+                ) from err
+            raise
+        # Drain the pipe so helm is not blocked on a full buffer.
+        proc.stdout.read()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args)
+
+
+def get_node_kind(node: yaml.Node) -> str | None:
+    """
+    Read the top-level 'kind' of a composed YAML document without constructing it.
+    Args:
+        node (yaml.Node): Root node of the composed YAML document.
+    Returns:
+        str | None: The resource kind or None if the document has no scalar 'kind'.
+    """
+
+    if not isinstance(node, yaml.MappingNode):
+        return None
+    for key_node, value_node in node.value:
+        if isinstance(key_node, yaml.ScalarNode) and key_node.value == "kind":
+            if isinstance(value_node, yaml.ScalarNode):
+                return value_node.value
+            return None
+    return None
 
 
-def extract_kind(yaml_text: str, kind_to_find: str) -> list[dict]:
+def prune_node(node: yaml.Node, keys: dict, pruned: dict | None = None) -> yaml.Node:
+    """
+    Build a copy of a composed YAML node without the mapping entries that are not
+    listed in keys, so they are never constructed into Python objects.
+    Merge keys ('<<') are kept and their values are pruned with the same keys.
+    The original node is left untouched, so anchors used elsewhere in the document
+    keep their full content.
+    Args:
+        node (yaml.Node): Composed YAML node.
+        keys (dict): Nested mapping of the keys to keep.
+        pruned (dict | None): Copies made so far, so aliased nodes stay shared.
+    Returns:
+        yaml.Node: The pruned node.
+    """
+
+    if pruned is None:
+        pruned = {}
+    memo_key = (id(node), id(keys))
+    if memo_key in pruned:
+        return pruned[memo_key]
+
+    if isinstance(node, yaml.SequenceNode):
+        # Lists of mappings, such as the value of a merge key, are pruned per item.
+        copy = yaml.SequenceNode(
+            node.tag, [], node.start_mark, node.end_mark, node.flow_style
+        )
+        pruned[memo_key] = copy
+        copy.value = [prune_node(item, keys, pruned) for item in node.value]
+        return copy
+    if not isinstance(node, yaml.MappingNode):
+        return node
+
+    copy = yaml.MappingNode(
+        node.tag, [], node.start_mark, node.end_mark, node.flow_style
+    )
+    pruned[memo_key] = copy
+    for key_node, value_node in node.value:
+        if not isinstance(key_node, yaml.ScalarNode):
+            continue
+        if key_node.tag == MERGE_TAG:
+            copy.value.append((key_node, prune_node(value_node, keys, pruned)))
+        elif key_node.value in keys:
+            subkeys = keys[key_node.value]
+            if subkeys is not None:
+                value_node = prune_node(value_node, subkeys, pruned)
+            copy.value.append((key_node, value_node))
+    return copy
+
+
+def split_by_kinds(yaml_stream: IO[bytes], kinds: set[str]) -> dict[str, list[dict]]:
     """
-    Extract all YAML documents of a specific Kubernetes resource kind from a YAML string.
+    Group YAML documents of the given Kubernetes resource kinds by kind in a single pass.
+    Documents are only composed into nodes first, so the ones of other kinds are
+    never constructed into Python objects, and matching ones are constructed with
+    only the keys listed in RELEVANT_KEYS.
     Args:
-        yaml_text (str): YAML string.
-        kind_to_find (str): The Kubernetes resource kind to extract.
+        yaml_stream (IO[bytes]): YAML stream.
+        kinds (set[str]): The Kubernetes resource kinds to extract.
     Returns:
-        list[dict]: List of YAML documents matching the specified kind.
+        dict[str, list[dict]]: YAML documents matching each of the specified kinds.
     """
 
-    found = []
-    for doc in yaml.safe_load_all(yaml_text):
-        if isinstance(doc, dict) and doc.get("kind") == kind_to_find:
-            found.append(doc)
+    found: dict[str, list[dict]] = {kind: [] for kind in kinds}
+    loader = YAML_LOADER(yaml_stream)
+    try:
+        while loader.check_node():
+            node = loader.get_node()
+            kind = get_node_kind(node)
+            if kind in found:
+                node = prune_node(node, RELEVANT_KEYS)
+                found[kind].append(loader.construct_document(node))
+    finally:
+        loader.dispose()
     return found
 
 
@@ -76,19 +223,18 @@ class Resource(ABC):
     """
 
     @staticmethod
-    def deep_get(data: dict, path: str, default=None) -> any:
+    def deep_get(data: dict, path: tuple[str, ...], default=None) -> any:
         """
-        Retrieve a nested value from a dictionary using a dot-separated path.
+        Retrieve a nested value from a dictionary using a path of keys.
         Args:
             data (dict): The dictionary to search.
-            path (str): Dot-separated path to the desired value.
+            path (tuple[str, ...]): Keys leading to the desired value.
             default: Default value to return if the path does not exist.
         Returns:
             any: The value at the specified path or the default value.
         """
 
-        keys = path.split(".")
-        for key in keys:
+        for key in path:
             if not isinstance(data, dict):
                 return default
             data = data.get(key)
@@ -115,39 +261,20 @@ class Resource(ABC):
         """
 
 
-class TemplateResource(Resource):
-    """
-    Represents a template resource with a name and kind.
-    """
-
-    def __init__(self, name: str, kind: str):
-        self._name = name
-        self._kind = kind
-
-    def kind(self) -> str:
-        return self._kind
-
-    def name(self) -> str:
-        return self._name
-
-    def deps_with_kinds(self) -> list[tuple[str, str]]:
-        return []
-
-
 class ServiceTemplate(Resource):
     """
     Represents a ServiceTemplate resource.
     """
 
     def __init__(self, template_yaml: dict) -> None:
-        self._name: str = self.deep_get(template_yaml, "metadata.name", "")
-        local_ref: dict = self.deep_get(template_yaml, "spec.resources.localSourceRef")
-        self.service_deps: list[TemplateResource] = []
+        self._name: str = self.deep_get(template_yaml, METADATA_NAME_PATH, "")
+        local_ref: dict = self.deep_get(template_yaml, LOCAL_SOURCE_REF_PATH)
+        self._deps: list[tuple[str, str]] = []
 
         if local_ref:
-            template_name: str = self.deep_get(local_ref, "name", "")
-            template_kind: str = self.deep_get(local_ref, "kind", "")
-            self.service_deps.append(TemplateResource(template_name, template_kind))
+            template_name: str = self.deep_get(local_ref, NAME_PATH, "")
+            template_kind: str = self.deep_get(local_ref, KIND_PATH, "")
+            self._deps.append((template_name, template_kind))
 
     def kind(self) -> str:
         return SERVICE_TEMPLATE_KIND
@@ -156,7 +283,7 @@ class ServiceTemplate(Resource):
         return self._name
 
     def deps_with_kinds(self) -> list[tuple[str, str]]:
-        return [(dep.name(), dep.kind()) for dep in self.service_deps]
+        return self._deps
 
 
 class MultiClusterService(Resource):
@@ -165,27 +292,25 @@ class MultiClusterService(Resource):
     """
 
     def __init__(self, mcs_yaml: dict) -> None:
-        self._name = self.deep_get(mcs_yaml, "metadata.name", "")
-        self.deps_template_resources: list[TemplateResource] = []
-        self.deps_service_names = []
-        self.deps_mcs_names = []
+        self._name = self.deep_get(mcs_yaml, METADATA_NAME_PATH, "")
+        deps_templates: list[tuple[str, str]] = []
+        deps_services: list[tuple[str, str]] = []
+        deps_mcs: list[tuple[str, str]] = []
 
-        deps_mcs = self.deep_get(mcs_yaml, "spec.dependsOn", [])
-        for name in deps_mcs:
-            self.deps_mcs_names.append(name)
+        for name in self.deep_get(mcs_yaml, DEPENDS_ON_PATH, []):
+            deps_mcs.append((name, MULTI_CLUSTER_SERVICE_KIND))
 
-        services = self.deep_get(mcs_yaml, "spec.serviceSpec.services", [])
+        services = self.deep_get(mcs_yaml, SERVICES_PATH, [])
         for service in services:
-            self.deps_service_names.append(service["template"])
+            deps_services.append((service["template"], SERVICE_TEMPLATE_KIND))
 
-        template_refs = self.deep_get(
-            mcs_yaml, "spec.serviceSpec.templateResourceRefs", []
-        )
+        template_refs = self.deep_get(mcs_yaml, TEMPLATE_RESOURCE_REFS_PATH, [])
         for template_ref in template_refs:
-            template_name = self.deep_get(template_ref, "resource.name", "")
-            template_kind = self.deep_get(template_ref, "resource.kind", "")
-            template_resource = TemplateResource(template_name, template_kind)
-            self.deps_template_resources.append(template_resource)
+            template_name = self.deep_get(template_ref, RESOURCE_NAME_PATH, "")
+            template_kind = self.deep_get(template_ref, RESOURCE_KIND_PATH, "")
+            deps_templates.append((template_name, template_kind))
+
+        self._deps = deps_services + deps_templates + deps_mcs
 
     def kind(self) -> str:
         return MULTI_CLUSTER_SERVICE_KIND
@@ -194,12 +319,7 @@ class MultiClusterService(Resource):
         return self._name
 
     def deps_with_kinds(self) -> list[tuple[str, str]]:
-        deps_templates = [(tr.name(), tr.kind()) for tr in self.deps_template_resources]
-        deps_services = [
-            (name, SERVICE_TEMPLATE_KIND) for name in self.deps_service_names
-        ]
-        deps_mcs = [(name, MULTI_CLUSTER_SERVICE_KIND) for name in self.deps_mcs_names]
-        return deps_services + deps_templates + deps_mcs
+        return self._deps
 
 
 class DiagramGenerator:
@@ -214,25 +334,29 @@ class DiagramGenerator:
     def generate_diagram(self) -> None:
         """
         Generate the Mermaid diagram and write it to the output file.
+        Duplicate edges are written once, in sorted order.
         """
 
+        edges: set[tuple[str, str]] = set()
+        for resource in self.resources:
+            resource_diagram_id_name = self.get_node_label(
+                resource.name(), resource.kind()
+            )
+            for raw_dep_name, raw_dep_kind in resource.deps_with_kinds():
+                dep_diagram_id_name = self.get_node_label(raw_dep_name, raw_dep_kind)
+                edges.add((resource_diagram_id_name, dep_diagram_id_name))
+
+        parts = ["```mermaid\n", "graph TD\n"]
+        for src, dst in sorted(edges):
+            parts.append(f"    {src} --> {dst}\n")
+        parts.append("```")
+
         with open(self.output_file_path, "w", encoding="utf-8") as f:
-            f.write("```mermaid\n")
-            f.write("graph TD\n")
-            for resource in self.resources:
-                resource_diagram_id_name = self.get_node_label(
-                    resource.name(), resource.kind()
-                )
-                for raw_dep_name, raw_dep_kind in resource.deps_with_kinds():
-                    dep_diagram_id_name = self.get_node_label(
-                        raw_dep_name, raw_dep_kind
-                    )
-                    f.write(
-                        f"    {resource_diagram_id_name} --> {dep_diagram_id_name}\n"
-                    )
-            f.write("```")
-
-    def clean_template_placeholders(self, name: str) -> str:
+            f.write("".join(parts))
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def clean_template_placeholders(name: str) -> str:
         """
         Cleans Helm template placeholders from a given name.
         Args:
@@ -241,33 +365,43 @@ class DiagramGenerator:
             str: The cleaned name without Helm template placeholders.
         """
 
-        return re.sub(r"\{\{\s*.(.*?)\s*\}\}", r"\1", name)
+        return PLACEHOLDER_RE.sub(r"\1", name)
 
-    def get_node_label(self, resource_name: str, resource_kind: str) -> str:
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_node_label(resource_name: str, resource_kind: str) -> str:
         """
         Generate a Mermaid diagram node label for a resource.
+        Labels are cached since the same resource appears in many edges.
         Args:
             resource_name (str): The name of the resource.
             resource_kind (str): The kind of the resource.
         Returns:
             str: The Mermaid diagram node label.
         """
-        clean_name = self.clean_template_placeholders(resource_name)
-        clean_kind = self.clean_template_placeholders(resource_kind)
+        clean_name = DiagramGenerator.clean_template_placeholders(resource_name)
+        clean_kind = DiagramGenerator.clean_template_placeholders(resource_kind)
         return f'{clean_name}/{clean_kind}["{clean_name} ({clean_kind})"]'
 
 
 if __name__ == "__main__":
     args = parse_arguments()
-    template = render_helm_template(args.chart_dir)
-    multi_cluster_services = extract_kind(template, MULTI_CLUSTER_SERVICE_KIND)
-    service_templates = extract_kind(template, SERVICE_TEMPLATE_KIND)
+    if YAML_LOADER is yaml.SafeLoader:
+        print(
+            "warning: PyYAML is built without libyaml, falling back to the slower "
+            "pure-Python parser",
+            file=sys.stderr,
+        )
+    with render_helm_template(args.chart_dir) as template:
+        docs_by_kind = split_by_kinds(
+            template, {MULTI_CLUSTER_SERVICE_KIND, SERVICE_TEMPLATE_KIND}
+        )
 
     resources = []
-    for mcs in multi_cluster_services:
+    for mcs in docs_by_kind[MULTI_CLUSTER_SERVICE_KIND]:
         resources.append(MultiClusterService(mcs))
 
-    for st in service_templates:
+    for st in docs_by_kind[SERVICE_TEMPLATE_KIND]:
         resources.append(ServiceTemplate(st))
 
     diagram_generator = DiagramGenerator(resources, args.output_file_path)